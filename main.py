@@ -1,28 +1,94 @@
 import functools
 import os
+import queue
+import random
 import sys
 import time
-from typing import Dict, Callable, Any
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait as wait_futures
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Callable, Any, List, Tuple
 
 from dotenv import dotenv_values
 
 from cloud_exceptions import CloudException, TokenException
 from loguru import logger
-from requests import ConnectionError
+from requests import ConnectionError, RequestException
+from watcher import start_observer, wait_changes
+from watchdog.observers import Observer
 from yandex_cloud import YandexCloud
 
 CONFIG = dotenv_values(".env")
 PATH_LOG_FILE: str = CONFIG.get("PATH_FILE_LOG")
 logger.add(f"{PATH_LOG_FILE}/cloud.log", level="INFO", rotation="100 MB")
 
+# Количество потоков для одновременной отправки запросов в облако
+MAX_WORKERS: int = 8
+
+# Сообщения для лога после успешной операции над файлом
+MESSAGES: Dict[str, str] = {
+    "load": "был сохранен.",
+    "reload": "был перезаписан.",
+    "delete": "был удален из облака.",
+}
+
+# Верхняя граница периода ожидания(в секундах) при повторяющихся ошибках синхронизации
+MAX_BACKOFF_PERIOD: int = 3600
+
+# Сколько секунд без новых событий в папке ждем перед запуском синхронизации
+DEBOUNCE_PERIOD: float = 2
+
+# Сколько секунд максимально собираем события в папке, если они идут без перерыва
+MAX_COALESCE_PERIOD: float = 30
+
+# Даты изменения локальных файлов на момент последней успешной синхронизации,
+# None если успешной синхронизации еще не было или последняя завершилась ошибкой.
+local_snapshot: Dict[str, float] | None = None
+
+
+@dataclass(frozen=True)
+class Config:
+    """
+    Настройки приложения из файла dotenv, уже проверенные и приведенные к нужным типам.
+
+    Attributes:
+        token (str): Токен для аутентификации с яндекс диском.
+        sleep_period (int): Период синхронизации в секундах.
+        path (Path): Путь к папке на компьютере, которую нужно синхронизировать.
+        folder_cloud (str): Имя папки в облаке, с которой будет синхронизация.
+    """
+    token: str
+    sleep_period: int
+    path: Path
+    folder_cloud: str
+
+    @classmethod
+    def load(cls) -> "Config":
+        """
+        Метод собирает настройки из dotenv и проверяет их.
+        Если какая-то настройка указана неверно, то завершаем работу приложения.
+
+        :return Config: Проверенные настройки приложения.
+        """
+        return cls(
+            token=check_required("YANDEX_TOKEN", CONFIG.get("YANDEX_TOKEN")),
+            sleep_period=check_sleep_period(CONFIG.get("SYNCHRONIZATION_PERIOD")),
+            path=check_path_exists(CONFIG.get("PATH_TO_FOLDER_ON_PC")),
+            folder_cloud=check_required("NAME_FOLDER_CLOUD", CONFIG.get("NAME_FOLDER_CLOUD")),
+        )
+
 
 def exception_decorator(func) -> Callable:
-    """Декоратор для обработки возможных ошибок при работе с облаком."""
+    """
+    Декоратор для обработки возможных ошибок при работе с облаком.
+    Если произошла ошибка, то логируем ее и возвращаем False.
+    """
 
     @functools.wraps(func)
     def wrapper(*args, **kwargs) -> Any:
         try:
-            func(*args, **kwargs)
+            return func(*args, **kwargs)
         except ConnectionError:
             logger.error("Нет соединения, проверьте подключение к сети.")
 
@@ -32,107 +98,232 @@ def exception_decorator(func) -> Callable:
         except CloudException as exc:
             logger.error(exc)
 
+        return False
+
     return wrapper
 
 
 @exception_decorator
 def synchronization(
-    path_on_pc: str,
-    cloud: YandexCloud
-) -> None:
+    path_on_pc: Path,
+    cloud: YandexCloud,
+    executor: ThreadPoolExecutor
+) -> bool:
     """
     Функция сравнивает файлы на пк и в облаке, если файла нет в облаке или дата изменения файла
     больше чем в облаке, то отправляем на сохранение в облако.
+    Если локальные файлы не менялись с последней успешной синхронизации и сверяться
+    с облаком еще рано, то в облако не обращаемся.
 
     :param path_on_pc: Путь к папке на компьютере, с которой будет синхронизировано облако.
     :param cloud: Экземпляр класса для работы с облаком.
+    :param executor: Пул потоков, в котором выполняются запросы к облаку.
+    :return bool: True если синхронизация прошла без ошибок.
     """
-    # Инициализируем переменные для подсчета сделанных операций при синхронизации
-    download_files: int = 0
-    deleted_files: int = 0
-    rewrite_files: int = 0
-    files_cloud: Dict[str, float] = cloud.get_info()
+    global local_snapshot
+
+    # Собираем файлы которые есть на пк в нашей папке,
+    # scandir сразу отдает полный путь и кэширует результат stat.
+    with os.scandir(path_on_pc) as entries:
+        files_pc: Dict[str, os.DirEntry] = {entry.name: entry for entry in entries if entry.is_file()}
 
-    # Проходимся циклом по списку файлов которые есть на пк в нашей папке
-    for file in os.listdir(path_on_pc):
-        modified: float = os.path.getmtime(f"{path_on_pc}/{file}")
-        file_cloud: float | None = files_cloud.pop(file) if file in files_cloud else None
+    # Файл могут удалить уже после получения списка, такой файл просто пропускаем.
+    current: Dict[str, float] = {}
+    for file, entry in list(files_pc.items()):
+        try:
+            current[file] = entry.stat().st_mtime
+        except FileNotFoundError:
+            del files_pc[file]
+
+    if current == local_snapshot and not cloud.reconcile_due():
+        logger.info("Изменений в папке нет.")
+        return True
+    local_snapshot = None
+
+    # Собираем список операций: (функция, аргументы, имя файла, тип операции),
+    # сами запросы выполняются потом в пуле потоков.
+    tasks: List[Tuple[Callable[..., Any], Tuple[Any, ...], str, str]] = []
+    files_cloud: Dict[str, float] = cloud.get_files()
+
+    for file, modified in current.items():
+        file_cloud: float | None = files_cloud.pop(file, None)
 
         # Файла нет в облаке, значит сохраняем его
         if not file_cloud:
-            cloud.load(path_on_pc, file)
-            logger.info(f"Файл {file}, был сохранен.")
-            download_files += 1
+            tasks.append((cloud.load, (files_pc[file].path, file, modified), file, "load"))
 
         # Дата изменения в облаке меньше чем в папке на пк, значит перезаписываем
         elif file_cloud and modified > file_cloud:
-            cloud.reload(path_on_pc, file)
-            logger.info(f"Файл {file}, был перезаписан.")
-            rewrite_files += 1
+            tasks.append((cloud.reload, (files_pc[file].path, file, modified), file, "reload"))
 
     # Если в словаре еще остались файлы, значит их нужно удалить, так как на пк их нет.
-    if len(files_cloud) > 0:
-        for filename in files_cloud.keys():
-            cloud.delete(filename)
-            logger.info(f"Файл {filename}, был удален из облака.")
-            deleted_files += 1
+    for filename in files_cloud:
+        tasks.append((cloud.delete, (filename,), filename, "delete"))
+
+    # Загрузки и удаления не зависят друг от друга, поэтому отправляем все в пул сразу.
+    # Ошибка по одному файлу, в том числе ошибка соединения или чтения файла,
+    # не останавливает остальные операции.
+    done: Counter = Counter()
+    errors: int = 0
+    futures: Dict[Future, Tuple[str, str]] = {
+        executor.submit(func, *args): (file, operation) for func, args, file, operation in tasks
+    }
+    try:
+        for future in as_completed(futures):
+            file, operation = futures[future]
+            try:
+                result: Any = future.result()
+            except CloudException as exc:
+                logger.error(exc)
+                errors += 1
+            except RequestException as exc:
+                logger.error("Файл: {}, Ошибка соединения: {}", file, exc)
+                errors += 1
+            except OSError as exc:
+                # Файл могли удалить или переименовать уже после проверки папки.
+                logger.error("Файл: {}, Ошибка чтения файла: {}", file, exc)
+                errors += 1
+            else:
+                # Удаление принято диском, но еще выполняется, результат покажет wait_operations.
+                if operation == "delete" and result is not None:
+                    continue
+                logger.info("Файл {}, {}", file, MESSAGES[operation])
+                done[operation] += 1
+    finally:
+        # Если синхронизация прервана ошибкой токена, то отменяем операции, которые еще
+        # не начались, и дожидаемся уже запущенных, чтобы они не ушли в следующий цикл.
+        for future in futures:
+            future.cancel()
+        wait_futures(futures)
+
+    # Удаление на диске асинхронное, дожидаемся его до следующего запроса списка файлов.
+    for filename, error in cloud.wait_operations():
+        if error:
+            logger.error(error)
+            errors += 1
+        else:
+            logger.info("Файл {}, {}", filename, MESSAGES["delete"])
+            done["delete"] += 1
 
     logger.info(
-        f"Загружено: {download_files}, Перезаписано: {rewrite_files}, Удалено: {deleted_files}"
+        "Загружено: {}, Перезаписано: {}, Удалено: {}", done["load"], done["reload"], done["delete"]
     )
+    if errors:
+        return False
+
+    local_snapshot = current
+    return True
+
+
+def check_required(name: str, value: str | None) -> str:
+    """
+    Проверяем что настройка указана в dotenv.
+    Если нет, то завершаем работу приложения.
+
+    :param name: Имя настройки в файле dotenv.
+    :param value: Значение настройки.
+    :return str: Значение настройки.
+    """
+    if not value:
+        logger.error("В файле dotenv не указан {}.", name)
+        sys.exit(0)
+    return value
 
 
-def check_path_exists(path: str) -> None:
+def check_path_exists(path: str | None) -> Path:
     """
     Проверяем существует ли путь указанный в dotenv.
     Если нет, то завершаем работу приложения.
 
     :param path: Путь к папке, которую нужно синхронизировать.
+    :return Path: Путь к папке.
     """
-    check: bool = os.path.exists(path)
-    if not check:
-        logger.error(f"Указанный путь к {path} не существует. Введите корректный путь.")
+    if not path or not os.path.exists(path):
+        logger.error("Указанный путь к {} не существует. Введите корректный путь.", path)
         sys.exit(0)
+    return Path(path)
 
 
-def check_sleep_period(period: str) -> None:
+def check_sleep_period(period: str | None) -> int:
     """
     Проверяем что в конфигурации указан правильный период времени,
     через который будет проходить синхронизация.
 
     :param period: Период который указан в файле dotenv.
+    :return int: Период синхронизации в секундах.
     """
-    if not period.isdigit():
+    if not period or not period.isdigit():
         logger.error(
             "Неверно указан период синхронизации, это должно быть целое число(измерение в секундах)."
         )
         sys.exit(0)
+    return int(period)
+
+
+def get_sleep_period(period: int, fail_count: int) -> float:
+    """
+    Функция считает сколько ждать до следующей синхронизации. После каждой неудачной
+    синхронизации подряд период удваивается(но не больше MAX_BACKOFF_PERIOD) и немного
+    случайно смещается, чтобы не отправлять запросы в облако с одинаковым интервалом.
+
+    :param period: Период синхронизации, который указан в файле dotenv.
+    :param fail_count: Количество неудачных синхронизаций подряд.
+    :return float: Период ожидания в секундах.
+    """
+    if fail_count == 0:
+        return period
+
+    backoff: float = max(period, min(period * 2 ** fail_count, MAX_BACKOFF_PERIOD))
+    return backoff + random.uniform(-0.2 * backoff, 0.2 * backoff)
+
+
+def wait(seconds: float) -> None:
+    """
+    Функция ждет указанное количество секунд короткими интервалами до дедлайна,
+    чтобы остановка приложения срабатывала сразу.
+
+    :param seconds: Сколько секунд нужно подождать.
+    """
+    deadline: float = time.monotonic() + seconds
+    while (remaining := deadline - time.monotonic()) > 0:
+        time.sleep(min(remaining, 1))
 
 
 def main():
     """
     Функция собирает переменные окружения, инициализирует объект и запускает бесконечный цикл.
+    Синхронизация запускается при изменениях в папке, а также раз в период из dotenv
+    на случай пропущенных событий.
     """
-    # Получаем нужные данные для работы.
-    token: str = CONFIG.get("YANDEX_TOKEN")
-    sleep_period: str = CONFIG.get("SYNCHRONIZATION_PERIOD")
-    path_to_folder_on_pc: str = CONFIG.get("PATH_TO_FOLDER_ON_PC")
-    name_folder_cloud: str = CONFIG.get("NAME_FOLDER_CLOUD")
+    # Получаем и проверяем нужные данные для работы.
+    config: Config = Config.load()
 
     # Инициализируем yandex
-    yandex: YandexCloud = YandexCloud(token, name_folder_cloud)
-
-    # Небольшие проверки для корректности работы.
-    check_path_exists(path_to_folder_on_pc)
-    check_sleep_period(sleep_period)
+    yandex: YandexCloud = YandexCloud(config.token, config.folder_cloud)
 
     # При запуске так же проверяем наличие папки в облаке, если нет то создаем.
     yandex.check_exists_folder_cloud()
 
-    while True:
-        logger.info("Запущен процесс синхронизации...")
-        synchronization(path_to_folder_on_pc, yandex)
-        time.sleep(int(sleep_period))
+    # Следим за изменениями в папке, события складываются в очередь.
+    events: queue.Queue = queue.Queue()
+    observer: Observer = start_observer(config.path, events)
+
+    # Пул потоков создаем один раз, потоки и их соединения переиспользуются между синхронизациями.
+    fail_count: int = 0
+    try:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            while True:
+                logger.info("Запущен процесс синхронизации...")
+                if synchronization(config.path, yandex, executor):
+                    fail_count = 0
+                    wait_changes(events, config.sleep_period, DEBOUNCE_PERIOD, MAX_COALESCE_PERIOD)
+                else:
+                    fail_count += 1
+                    yandex.reset_state()
+                    wait(get_sleep_period(config.sleep_period, fail_count))
+    finally:
+        observer.stop()
+        observer.join()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,81 @@
+"""Модуль для отслеживания изменений файлов в папке на компьютере."""
+import queue
+import time
+from pathlib import Path
+
+from watchdog.events import (
+    EVENT_TYPE_CREATED,
+    EVENT_TYPE_DELETED,
+    EVENT_TYPE_MODIFIED,
+    EVENT_TYPE_MOVED,
+    FileSystemEvent,
+    FileSystemEventHandler,
+)
+from watchdog.observers import Observer
+
+# События, после которых нужна синхронизация. Открытие и чтение файла сюда не входят,
+# иначе загрузка файла в облако сама вызывала бы новую синхронизацию.
+SYNC_EVENTS = {EVENT_TYPE_CREATED, EVENT_TYPE_DELETED, EVENT_TYPE_MODIFIED, EVENT_TYPE_MOVED}
+
+
+class ChangesHandler(FileSystemEventHandler):
+    """
+    Обработчик событий файловой системы, складывает события в очередь.
+
+    Args:
+        events (queue.Queue): Очередь, в которую складываются события об изменениях файлов.
+    """
+
+    def __init__(self, events: queue.Queue):
+        self.events = events
+
+    def on_any_event(self, event: FileSystemEvent) -> None:
+        """
+        Метод вызывается на каждое событие в папке, нужные события отправляем в очередь.
+
+        :param event: Событие файловой системы.
+        """
+        if not event.is_directory and event.event_type in SYNC_EVENTS:
+            self.events.put(event)
+
+
+def start_observer(path: Path, events: queue.Queue) -> Observer:
+    """
+    Функция запускает отслеживание изменений в папке.
+
+    :param path: Путь к папке, изменения в которой нужно отслеживать.
+    :param events: Очередь, в которую будут складываться события.
+    :return Observer: Запущенный наблюдатель, его нужно остановить при завершении работы.
+    """
+    observer: Observer = Observer()
+    observer.schedule(ChangesHandler(events), path, recursive=False)
+    observer.start()
+    return observer
+
+
+def wait_changes(events: queue.Queue, timeout: float, debounce: float, max_coalesce: float) -> bool:
+    """
+    Функция ждет первое событие не дольше timeout секунд, после чего собирает
+    следующие события, пока между ними проходит меньше debounce секунд.
+    Так серия изменений одного или нескольких файлов приводит к одной синхронизации.
+    Если события идут без перерыва, то собираем их не дольше max_coalesce секунд,
+    чтобы постоянно изменяемый файл не откладывал синхронизацию бесконечно.
+
+    :param events: Очередь с событиями об изменениях файлов.
+    :param timeout: Сколько секунд максимально ждать первое событие.
+    :param debounce: Сколько секунд без новых событий считаем окончанием изменений.
+    :param max_coalesce: Сколько секунд максимально собираем события после первого.
+    :return bool: True если были изменения, False если вышло время ожидания.
+    """
+    try:
+        events.get(timeout=timeout)
+    except queue.Empty:
+        return False
+
+    deadline: float = time.monotonic() + max_coalesce
+    while (remaining := deadline - time.monotonic()) > 0:
+        try:
+            events.get(timeout=min(debounce, remaining))
+        except queue.Empty:
+            return True
+    return True
@@ -1,8 +1,13 @@
-import json
+import time
+from calendar import timegm
+from collections import deque
 from datetime import datetime as dt
-from typing import Dict
+from typing import Deque, Dict, List, Tuple
 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from cloud_exceptions import TokenException, CloudException
 
@@ -17,8 +22,31 @@ class YandexCloud:
 
     Attributes:
         url (str): Базовый url для запросов к диску.
+        upload_url (str): Url для получения ссылки на загрузку файла.
+        pool_size (int): Количество соединений, которые держим открытыми для каждого хоста.
+        reconcile_period (int): Через сколько секунд после последнего запроса списка файлов
+            он заново запрашивается из облака, чтобы учесть изменения сделанные в самом облаке.
+        max_pending (int): Сколько асинхронных операций удаления может выполняться на диске
+            одновременно, прежде чем delete начнет ждать их завершения.
+        operation_poll_period (float): Период опроса статуса асинхронной операции в секундах.
+        operation_timeout (float): Сколько секунд максимально ждем завершения одной
+            асинхронной операции.
+        upload_attempts (int): Сколько раз пробуем загрузить файл по одной ссылке при сбое
+            соединения или временной ошибке сервера.
+        retry_statuses (tuple): Коды ответа сервера, при которых запрос имеет смысл повторить.
+        retry_backoff (float): Пауза перед первым повтором загрузки в секундах, перед каждым
+            следующим повтором пауза удваивается.
     """
     url = "https://cloud-api.yandex.net/v1/disk/resources"
+    upload_url = f"{url}/upload"
+    pool_size = 16
+    reconcile_period = 3600
+    max_pending = 32
+    operation_poll_period = 0.5
+    operation_timeout = 60
+    upload_attempts = 3
+    retry_statuses = (500, 502, 503, 504)
+    retry_backoff = 0.5
 
     def __init__(self, token: str, name_folder_cloud: str):
         self.name_folder_cloud = name_folder_cloud
@@ -28,78 +56,325 @@ class YandexCloud:
             "Authorization": f"OAuth {token}"
         }
 
-    def __save(self, url: str, path: str, file_name: str) -> None:
+        # Сессия для запросов к api диска, соединения переиспользуются между запросами.
+        # После исчерпания повторов возвращаем последний ответ, его код обрабатывают методы ниже.
+        retry = Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=[429, *self.retry_statuses],
+            raise_on_status=False
+        )
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        self.session.mount("https://", HTTPAdapter(
+            pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=retry
+        ))
+
+        # Отдельная сессия для загрузки файлов, так как загрузка идет на другой хост.
+        self.upload_session = requests.Session()
+        self.upload_session.mount("https://", HTTPAdapter(
+            pool_connections=self.pool_size, pool_maxsize=self.pool_size
+        ))
+
+        # Последний полученный список файлов в облаке и его ETag, для условных запросов.
+        self._info_cache: Dict[str, float] | None = None
+        self._etag: str | None = None
+
+        # Состояние облачной папки, которое обновляется после каждой успешной операции,
+        # чтобы не запрашивать список файлов из облака каждую синхронизацию.
+        self._cloud_state: Dict[str, float] | None = None
+        self._reconciled_at: float = 0
+
+        # Незавершенные асинхронные операции удаления: (ссылка на статус операции, имя файла).
+        self._operations: Deque[Tuple[str, str]] = deque()
+        # Завершенные операции удаления: (имя файла, текст ошибки или None если файл удален).
+        self._finished: List[Tuple[str, str | None]] = []
+
+    @staticmethod
+    def __error_message(response: requests.Response) -> str:
+        """
+        Метод достает текст ошибки из ответа диска. Если тело ответа не JSON,
+        например html страница от шлюза при 502 или пустое тело, то возвращаем код ответа.
+
+        :param response: Ответ диска с ошибкой.
+        :return str: Текст ошибки.
+        """
+        try:
+            data = orjson.loads(response.content)
+        except orjson.JSONDecodeError:
+            data = None
+
+        if isinstance(data, dict) and data.get("message"):
+            return data["message"]
+        return f"код ответа {response.status_code}"
+
+    def __save(self, params: Dict[str, str], file_path: str, file_name: str, modified: float) -> None:
         """
         Метод для сохранения файла в облаке, нужен для методов load и reload,
         так как методы практически одинаковые.
 
-        :param url: Сформированный url для загрузки файла.
-        :param path: Путь к файлу на пк.
+        :param params: Параметры запроса для получения ссылки на загрузку файла.
+        :param file_path: Полный путь к файлу на пк.
         :param file_name: Имя файла который нужно сохранить.
-        :raise CloudException: Если запрос завершился кодом отличным от 200, пробрасываем исключение.
+        :param modified: Дата изменения файла на момент проверки папки, ее запоминаем
+            в состоянии облачной папки, а не читаем заново после загрузки.
+        :raise CloudException: Если запрос на получение ссылки завершился кодом отличным от 200
+            или не удалась сама загрузка файла, пробрасываем исключение.
         """
-        response = requests.get(url, headers=self.headers)
+        response = self.session.get(self.upload_url, params=params)
         if response.status_code == 200:
-            data: json = response.json()
-            with open(f"{path}/{file_name}", "rb") as file:
-                requests.put(data['href'], files={'file': file})
+            data: dict = orjson.loads(response.content)
+            upload_response = self.__upload(data['href'], file_path)
+            if not upload_response.ok:
+                message: str = f"Файл: {file_name}, Ошибка загрузки: {upload_response.status_code}"
+                raise CloudException(message)
+            self._etag = None
+            if self._cloud_state is not None:
+                self._cloud_state[file_name] = modified
         else:
-            message: str = f"Файл: {file_name}, Ошибка: {response.json().get('message')}"
+            message: str = f"Файл: {file_name}, Ошибка: {self.__error_message(response)}"
             raise CloudException(message)
 
-    def load(self, path: str, file_name: str) -> None:
+    def __upload(self, href: str, file_path: str) -> requests.Response:
         """
-        Метод формирует url для загрузки файла., и отправляет непосредственно на сохранение.
-        :param path: Путь к файлу.
+        Метод загружает файл по полученной ссылке. При сбое соединения или временной ошибке
+        сервера(retry_statuses) файл открывается заново и загрузка повторяется с паузой,
+        но не больше upload_attempts раз. Каждая попытка отправляет файл целиком.
+        Остальные ошибки, например 507 при заполненном диске, не повторяются.
+
+        :param href: Ссылка для загрузки файла.
+        :param file_path: Полный путь к файлу на пк.
+        :return Response: Ответ на последнюю попытку загрузки.
+        :raise ConnectionError: Если не удалось соединиться ни в одной из попыток.
+        """
+        for attempt in range(1, self.upload_attempts + 1):
+            if attempt > 1:
+                time.sleep(self.retry_backoff * 2 ** (attempt - 2))
+            try:
+                # Тело файла отправляем как есть, потоком, диск не ждет multipart.
+                with open(file_path, "rb") as file:
+                    response = self.upload_session.put(href, data=file)
+            except requests.ConnectionError:
+                if attempt == self.upload_attempts:
+                    raise
+                continue
+
+            if response.status_code not in self.retry_statuses or attempt == self.upload_attempts:
+                return response
+
+    def load(self, file_path: str, file_name: str, modified: float) -> None:
+        """
+        Метод формирует параметры для загрузки файла, и отправляет непосредственно на сохранение.
+        :param file_path: Полный путь к файлу.
         :param file_name: Имя файла для сохранения в облаке.
+        :param modified: Дата изменения файла на момент проверки папки.
         """
-        url: str = f"{self.url}/upload?path={self.name_folder_cloud}/{file_name}&overwrite=False"
-        self.__save(url, path, file_name)
+        params: Dict[str, str] = {"path": f"{self.name_folder_cloud}/{file_name}", "overwrite": "False"}
+        self.__save(params, file_path, file_name, modified)
 
-    def reload(self, path: str, file_name: str) -> None:
+    def reload(self, file_path: str, file_name: str, modified: float) -> None:
         """
-        Метод формирует url для перезаписи файла., и отправляет непосредственно на сохранение.
+        Метод формирует параметры для перезаписи файла, и отправляет непосредственно на сохранение.
 
-        :param path: Путь к файлу.
+        :param file_path: Полный путь к файлу.
         :param file_name: Имя файла для сохранения в облаке.
+        :param modified: Дата изменения файла на момент проверки папки.
         """
-        url = f"{self.url}/upload?path={self.name_folder_cloud}/{file_name}&overwrite=True"
-        self.__save(url, path, file_name)
+        params: Dict[str, str] = {"path": f"{self.name_folder_cloud}/{file_name}", "overwrite": "True"}
+        self.__save(params, file_path, file_name, modified)
 
-    def delete(self, filename: str) -> None:
+    def delete(self, filename: str) -> str | None:
         """
-        Метод для удаления файла в облаке.
+        Метод для удаления файла в облаке. Удаление выполняется на диске асинхронно,
+        если незавершенных операций больше чем max_pending, то ждем завершения самых старых.
+        Результат асинхронного удаления возвращает wait_operations.
 
         :param filename: Имя удаляемого файла.
-        :raise CloudException: Если запрос завершился кодом отличным от 204, пробрасываем исключение.
+        :return str | None: Ссылка на статус операции удаления, None если файл удален сразу.
+        :raise CloudException: Если запрос завершился кодом отличным от 202 и 204,
+            пробрасываем исключение.
         """
-        url: str = f"{self.url}?path={self.name_folder_cloud}/{filename}&force_async=False&permanently=False"
-        response = requests.delete(url, headers=self.headers)
-        if response.status_code != 204:
-            message: str = f"Файл: {filename}, Ошибка: {response.json().get('message')}"
+        params: Dict[str, str] = {
+            "path": f"{self.name_folder_cloud}/{filename}",
+            "force_async": "True",
+            "permanently": "False",
+        }
+        response = self.session.delete(self.url, params=params)
+        if response.status_code not in (202, 204):
+            message: str = f"Файл: {filename}, Ошибка: {self.__error_message(response)}"
             raise CloudException(message)
 
+        self._etag = None
+        if self._cloud_state is not None:
+            self._cloud_state.pop(filename, None)
+
+        if response.status_code == 204:
+            return None
+
+        operation: str = orjson.loads(response.content)["href"]
+        self._operations.append((operation, filename))
+        while len(self._operations) > self.max_pending:
+            try:
+                self.__finish_operation(*self._operations.popleft())
+            except IndexError:
+                break
+        return operation
+
+    def __wait_operation(self, operation: str, filename: str) -> None:
+        """
+        Метод опрашивает статус асинхронной операции, пока она не завершится,
+        но не дольше operation_timeout секунд.
+
+        :param operation: Ссылка на статус операции.
+        :param filename: Имя файла, к которому относится операция.
+        :raise CloudException: Если операция завершилась ошибкой, не завершилась вовремя
+            или статус не удалось получить.
+        """
+        deadline: float = time.monotonic() + self.operation_timeout
+        while True:
+            response = self.session.get(operation)
+            if response.status_code != 200:
+                message: str = f"Файл: {filename}, Ошибка: {self.__error_message(response)}"
+                raise CloudException(message)
+
+            status: str = orjson.loads(response.content)["status"]
+            if status == "success":
+                return
+            if status == "failed":
+                raise CloudException(f"Файл: {filename}, Ошибка: не удалось удалить файл.")
+            if time.monotonic() >= deadline:
+                raise CloudException(
+                    f"Файл: {filename}, Ошибка: удаление не завершилось за {self.operation_timeout} сек."
+                )
+            time.sleep(self.operation_poll_period)
+
+    def __finish_operation(self, operation: str, filename: str) -> None:
+        """
+        Метод дожидается асинхронной операции удаления и запоминает ее результат,
+        ошибка операции относится к ее файлу и не пробрасывается вызывающему.
+
+        :param operation: Ссылка на статус операции.
+        :param filename: Имя файла, к которому относится операция.
+        """
+        error: str | None = None
+        try:
+            self.__wait_operation(operation, filename)
+        except CloudException as exc:
+            error = str(exc)
+        except requests.RequestException as exc:
+            error = f"Файл: {filename}, Ошибка соединения: {exc}"
+        self._finished.append((filename, error))
+
+    def wait_operations(self) -> List[Tuple[str, str | None]]:
+        """
+        Метод ждет завершения всех незавершенных асинхронных операций удаления.
+
+        :return list: Результаты всех операций, завершенных с прошлого вызова,
+            в виде (имя файла, текст ошибки или None если файл удален).
+        """
+        while self._operations:
+            try:
+                self.__finish_operation(*self._operations.popleft())
+            except IndexError:
+                break
+
+        finished, self._finished = self._finished, []
+        return finished
+
     def get_info(self) -> Dict[str, float] | None:
         """
         Метод для получения списка файлов в облачной папке.
+        Если список не изменился с прошлого запроса (ответ 304), то возвращаем копию из кэша.
 
         :return dict: Возвращает словарь, где ключ имя файла, значение последнее изменение файла.
+            Папки в словарь не попадают.
         :raises CloudException, TokenException: Если запрос завершился кодом 401, это значит
             что проблемы с токеном, если какие-то другие проблемы, то вызываем CloudException.
         """
-        url: str = f"{self.url}?path={self.name_folder_cloud}&fields=items&limit=10000"
-        response = requests.get(url, headers=self.headers)
+        # Просим у диска только тип, имя и дату изменения ресурсов, остальные поля нам не нужны.
+        params: Dict[str, str] = {
+            "path": self.name_folder_cloud,
+            "fields": "_embedded.items.type,_embedded.items.name,_embedded.items.modified",
+            "limit": "10000",
+        }
+        headers: Dict[str, str] = {"If-None-Match": self._etag} if self._etag else {}
+        response = self.session.get(self.url, params=params, headers=headers)
 
-        if response.status_code == 200:
+        if response.status_code == 304 and self._info_cache is not None:
+            self.__set_state(self._info_cache)
+            return self._info_cache.copy()
+
+        elif response.status_code == 200:
             files: dict = {}
-            for item in response.json()["_embedded"]["items"]:
-                files[item.get("name")] = dt.fromisoformat(item.get("modified")).timestamp()
-            return files
+            for item in orjson.loads(response.content)["_embedded"]["items"]:
+                # Синхронизируются только файлы, папки в облаке не трогаем.
+                if item["type"] != "file":
+                    continue
+
+                # Обычно диск отдает дату в UTC в виде "2024-05-01T12:34:56+00:00", такую строку
+                # разбираем по срезам, без создания объекта datetime. Любой другой формат
+                # разбираем через datetime, чтобы не потерять смещение часового пояса.
+                modified: str = item["modified"]
+                if len(modified) == 25 and modified[19:] == "+00:00":
+                    files[item["name"]] = timegm((
+                        int(modified[0:4]), int(modified[5:7]), int(modified[8:10]),
+                        int(modified[11:13]), int(modified[14:16]), int(modified[17:19]), 0, 0, 0
+                    ))
+                else:
+                    files[item["name"]] = dt.fromisoformat(modified).timestamp()
+            self._info_cache = files
+            self._etag = response.headers.get("ETag")
+            self.__set_state(files)
+            return files.copy()
 
         elif response.status_code == 401:
             raise TokenException
         else:
-            raise CloudException(response.json().get("message"))
+            raise CloudException(self.__error_message(response))
+
+    def __set_state(self, files: Dict[str, float]) -> None:
+        """
+        Метод сохраняет полученный из облака список файлов как текущее состояние облачной папки.
+
+        :param files: Словарь, где ключ имя файла, значение последнее изменение файла.
+        """
+        self._cloud_state = files.copy()
+        self._reconciled_at = time.monotonic()
+
+    def reconcile_due(self) -> bool:
+        """
+        Метод проверяет, нужно ли заново запросить список файлов из облака: состояние
+        было сброшено или с последнего запроса прошло больше reconcile_period секунд.
+
+        :return bool: True если список файлов нужно запросить из облака.
+        """
+        return (
+            self._cloud_state is None
+            or time.monotonic() - self._reconciled_at >= self.reconcile_period
+        )
+
+    def get_files(self) -> Dict[str, float]:
+        """
+        Метод для получения списка файлов в облачной папке без лишних запросов.
+        Возвращает сохраненное состояние, а если пора свериться с облаком(reconcile_due),
+        то запрашивает список из облака через get_info.
+
+        :return dict: Возвращает словарь, где ключ имя файла, значение последнее изменение файла.
+        """
+        if self.reconcile_due():
+            return self.get_info()
+        return self._cloud_state.copy()
+
+    def reset_state(self) -> None:
+        """
+        Метод сбрасывает сохраненное состояние облачной папки, например после ошибки
+        синхронизации, чтобы следующий get_files запросил список файлов из облака.
+        Незавершенные и еще не показанные операции удаления тоже забываем, они относятся
+        к прерванной синхронизации, а результат удаления покажет новый список файлов.
+        """
+        self._cloud_state = None
+        self._operations.clear()
+        self._finished.clear()
 
     def __create_folder_cloud(self):
         """
@@ -107,10 +382,9 @@ class YandexCloud:
 
         :raise CloudException: Если произошел непредвиденный сбой.
         """
-        url = f"{self.url}?path={self.name_folder_cloud}"
-        response = requests.put(url, headers=self.headers)
+        response = self.session.put(self.url, params={"path": self.name_folder_cloud})
         if response.status_code != 201:
-            message: str = f"Ошибка: {response.json().get('message')}"
+            message: str = f"Ошибка: {self.__error_message(response)}"
             raise CloudException(message)
 
     def check_exists_folder_cloud(self):
@@ -118,7 +392,7 @@ class YandexCloud:
         Метод для проверки существует ли папка указанная в dotenv на яндекс диске,
         если нет, то отправляем на создание таковой.
         """
-        url: str = f"{self.url}?path={self.name_folder_cloud}&limit=1"
-        response = requests.get(url, headers=self.headers)
+        params: Dict[str, str] = {"path": self.name_folder_cloud, "limit": "1"}
+        response = self.session.get(self.url, params=params)
         if response.status_code == 404:
             self.__create_folder_cloud()